@@ -1,3 +1,10 @@
+from os import makedirs
+from os.path import dirname, join
+
+import matplotlib.pyplot as plt
+import pandas as pd
+
+
 class Plot:
     '''
     modified version of PlotCsv
@@ -21,11 +28,13 @@ class Plot:
     # methods
     def Bode (
         self, destination: str, mode: str,
-        figsize = (9, 6), dpi = 100
+        figsize = (9, 6), dpi = 100, show = False
         ):
-   
-        import pandas as pd
-        import matplotlib.pyplot as plt
+        """
+        Plots one Bode diagram channel of the csv source and saves it as
+        destination in the 'Results' directory. The figure is shown if show
+        is True, otherwise it is closed, which allows headless batch use.
+        """
 
         if (mode == "magnitude"):
                 title = 'Magnitude'
@@ -43,31 +52,41 @@ class Plot:
             xAxisLabel = 'Frequency [Hz]'
             scale = 'log'  
 
-        dataframe = pd.read_csv(self.source, self.sep, header = self.header)
+        # only parse the two plotted columns
+        dataframe = pd.read_csv(
+            self.source, sep = self.sep, header = self.header,
+            usecols = [x, y], dtype = 'float32'
+            )
         
-        plt.rcParams["figure.figsize"] = figsize
-        plt.rcParams["figure.dpi"] = dpi
-        plt.plot(dataframe[x], dataframe[y])
-        plt.title(title)
-        plt.xlabel(xAxisLabel)
-        plt.ylabel(yAxisLabel)
-        plt.xscale(scale)        
-        plt.savefig(ResultsPath() + destination)
-        plt.show()
+        fig, ax = plt.subplots(figsize = figsize, dpi = dpi)
+        ax.plot(dataframe[x], dataframe[y])
+        ax.set_title(title)
+        ax.set_xlabel(xAxisLabel)
+        ax.set_ylabel(yAxisLabel)
+        ax.set_xscale(scale)
+        fig.savefig(join(ResultsPath(), destination))
+        if show:
+            plt.show()
+        else:
+            plt.close(fig)
+
 
+# cached by ResultsPath() after the first call
+_results_dir = None
 
 def ResultsPath():
     '''
     Helper for ipynb files, which cannot access the os module.
     Gets path of the currently executing assembly and creates
     a 'Results' subdirectory, if it doesn't already exists.
+    The path ends with a separator, so file names can be appended
+    directly. It is only resolved once and cached afterwards.
     '''
-    from os import makedirs
-    from os.path import dirname, join, isdir
-    script_dir = dirname(__file__)
-    results_dir = join(script_dir, 'Results\\')
-    if not isdir(results_dir):
-        makedirs(results_dir)
-    return results_dir
-
-    
\ No newline at end of file
+    global _results_dir
+    if _results_dir is None:
+        script_dir = dirname(__file__)
+        # the trailing '' adds the platform's path separator
+        results_dir = join(script_dir, 'Results', '')
+        makedirs(results_dir, exist_ok=True)
+        _results_dir = results_dir
+    return _results_dir
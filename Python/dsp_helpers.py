@@ -1,4 +1,16 @@
 # audio DSP education, algorithm development, test and documentation module
+import math
+
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.signal import oaconvolve
+
+try:
+    from numba import njit, prange
+    _HAVE_NUMBA = True
+except ImportError:
+    # numba is optional. without it the effects fall back to their vectorized numpy implementation
+    _HAVE_NUMBA = False
 
 def toMono(signal):
     '''
@@ -9,9 +21,9 @@ def toMono(signal):
     Returns:
       The amplitude adjusted signal with summed channels
     '''
-    if (signal.ndim >  1):
-        length = signal.shape[0]
-        signal = normalize((signal[0:length:1, 0] + signal[0:length:1, 1]))
+    if (signal.ndim > 1):
+        # sum in floating point, so integer pcm samples cannot overflow
+        signal = normalize(np.add(signal[:, 0], signal[:, 1], dtype=_float_dtype(signal)))
     return signal
 
 
@@ -30,8 +42,9 @@ def normalize(ys, amp=0.99):
     Returns: 
       a wave array so the maximum amplitude is +amp or -amp.
     """
-    high, low = abs(max(ys)), abs(min(ys))
-    return amp * (ys / max(high, low))
+    # peak magnitude of the waveform, computed in a single numpy reduction
+    peak = np.abs(ys).max()
+    return (amp / peak) * ys
 
 def time(signal, samplingRate):
     """
@@ -44,18 +57,19 @@ def time(signal, samplingRate):
     Returns:
       time-base array
     """
-    from numpy import linspace
     #get length of signal in seconds by dividing the amount of samples by the sample rate
     signalLength = len(signal) / samplingRate
     # create evenly spaced ndarray
-    return linspace(0, signalLength, len(signal))
+    return np.linspace(0, signalLength, len(signal))
 
 # functions to convert scales
 def dB_to_magnitude(dB):
     return 10 ** (dB / 20)   
 def magnitude_to_dB(mag):
-    from numpy import log10
-    return 20 * log10(mag)  
+    # plain positive numbers take the cheaper math.log10, arrays (and 0, which maps to -inf) go through numpy
+    if isinstance(mag, (int, float)) and mag > 0:
+        return 20 * math.log10(mag)
+    return 20 * np.log10(mag)
     
 def plot(signal, samplingrate, ax = None, start = None, end = None, **plt_kwargs):
     """  
@@ -74,7 +88,6 @@ def plot(signal, samplingrate, ax = None, start = None, end = None, **plt_kwargs
     Returns: 
       figure object of the relative signal amplitude plotted against time.
     """
-    import matplotlib.pyplot as plt
     if ax is None:
         ax = plt.gca()
 
@@ -92,7 +105,7 @@ def annotate_plot(ax, title, xlabel = "Time, seconds", ylabel = "Signal amplitud
     ax.set(xlabel = xlabel, ylabel = ylabel, title = title)
 
 
-def triangle(A, N):
+def triangle(A, N, dtype = np.float32):
     '''
     Summary:
       Create an array with values representing a triangle wave without
@@ -100,16 +113,13 @@ def triangle(A, N):
     Parameters:
       A:            - amplitude
       N:            - number of samples
+      dtype:        - sample data type (optional)
     Returns:
       wave array of a triangle wave    
     '''
-    from numpy import zeros, abs
-    i = 0
-    x = zeros(N)
-    while (i < N):        
-        x[i] = 2 * abs((i % 2 * A) - A) - A
-        i += 1
-    return x
+    # integer sample index, a float32 index can't represent odd values above 2**24
+    i = np.arange(N)
+    return (2 * np.abs((i % 2 * A) - A) - A).astype(dtype, copy=False)
     
 def triangle_alt(t):
     '''
@@ -117,16 +127,17 @@ def triangle_alt(t):
       Create a single sample representing the normalized amplitude
       of a triangle wave at time t. The frequency can be controlled 
       by changing the time increments between samples.
+      t may also be an array of time values.
     Parameters:
       t:           - time
     Returns:
       A sample with the normalized amplitude of a triangle signal 
       at a specific time value
     '''
-    from numpy import arcsin, cos
-    return arcsin(cos(t)) / 1.57079633
+    # same wave form as arcsin(cos(t)) / (pi / 2), without the two transcendental functions
+    return 1 - (2 / np.pi) * np.abs(((t + np.pi) % (2 * np.pi)) - np.pi)
     
-def sawtooth(A, N):
+def sawtooth(A, N, dtype = np.float32):
     '''
     Summary:
       Create an array with values representing a sawtooth wave with amplitude A
@@ -134,37 +145,34 @@ def sawtooth(A, N):
     Parameters:
       A         - amplitude
       N         - number of samples
+      dtype     - sample data type (optional)
     Returns:
       An array containing N samples, resembling a sawtooth wave.
     '''
-    from numpy import zeros
-    i = 0
-    x = zeros(N)
-    while (i < N):
-        x[i] = (i % (2 * A + 1)) - A
-        i += 1
-    return x
+    # integer sample index, a float32 index can't represent odd values above 2**24
+    i = np.arange(N)
+    return ((i % (2 * A + 1)) - A).astype(dtype, copy=False)
 
 def square_wave(t):
     '''
     Summary:
-      Return a single sample representing the normalized amplitude
-      of a square wave at time t. The frequency can be controlled 
-      by changing the time increments between samples.
+      Return the normalized amplitude of a square wave at time t.
+      t may be a single time value or an array of time values.
+      The frequency can be controlled by changing the time
+      increments between samples.
     Parameters:
       t         - time
     Returns:
       1         if sin(t) is positive
       -1        otherwise
+      an int for a single time value, an array for an array of time values
     '''
-    from numpy import sin
-    x = sin(t)
-    if (x >= 0.0):
-        return 1
-    else:
-        return -1
-
-def sine_wave(A, f, Fs, s):
+    x = np.where(np.sin(t) >= 0.0, 1, -1)
+    if (np.ndim(t) == 0):
+        return int(x)
+    return x
+
+def sine_wave(A, f, Fs, s, dtype = np.float32):
     '''
     Summary:
       Generates a sine wave. 
@@ -173,18 +181,22 @@ def sine_wave(A, f, Fs, s):
       f         - frequency
       Fs        - sampling frequency / sampling rate
       s         - total duration of the returned signal in seconds
+      dtype     - sample data type (optional)
     Returns:
       An array containing Fs * s samples, resembling a sine wave.
 
     '''
-    from numpy import pi, linspace, zeros, sin
-    w = f / 2 * pi
-    t = linspace(0, s, Fs * s)
-    x = zeros(len(t))
-    x = A * sin(w * t)
-    return x
-
-def cos_wave(A, f, Fs, s):
+    # the phase is evaluated in double precision, a float32 phase would drift
+    # noticeably for long signals. only the result is stored as dtype, which is
+    # a copy unless dtype is float64.
+    t = np.linspace(0, s, round(Fs * s))
+    # evaluate A * sin(2 * pi * f * t) in place, reusing the time-base buffer
+    x = np.multiply(t, 2 * np.pi * f, out=t)
+    np.sin(x, out=x)
+    x *= A
+    return x.astype(dtype, copy=False)
+
+def cos_wave(A, f, Fs, s, dtype = np.float32):
     '''
     Summary:
       Generates a cosine wave. 
@@ -193,18 +205,86 @@ def cos_wave(A, f, Fs, s):
       f         - frequency
       Fs        - sampling frequency / sampling rate
       s         - total duration of the returned signal in seconds
+      dtype     - sample data type (optional)
     Returns:
       An array containing Fs * s samples, resembling a cosine wave.
 
     '''
-    from numpy import pi, linspace, zeros, cos
-    w = f / 2 * pi
-    t = linspace(0, s, Fs * s)
-    x = zeros(len(t))
-    x = A * cos(w * t)
-    return x
+    # the phase is evaluated in double precision, a float32 phase would drift
+    # noticeably for long signals. only the result is stored as dtype, which is
+    # a copy unless dtype is float64.
+    t = np.linspace(0, s, round(Fs * s))
+    # evaluate A * cos(2 * pi * f * t) in place, reusing the time-base buffer
+    x = np.multiply(t, 2 * np.pi * f, out=t)
+    np.cos(x, out=x)
+    x *= A
+    return x.astype(dtype, copy=False)
+
+def _float_dtype(signal):
+    # float32 and float64 signals keep their precision, integer pcm samples
+    # are promoted to the smallest float type that holds them exactly
+    return np.result_type(signal.dtype, np.float32)
+
+def _output(out, length, dtype):
+    '''
+    Summary:
+      Output buffer handling shared by the effects.
+    Parameters:
+      out:          - caller supplied output array or None
+      length:       - number of samples the effect produces
+      dtype:        - sample data type of a newly allocated array. a caller
+                      supplied array must be able to hold it
+    Returns:
+      out, or a new array with the given length if out is None
+    '''
+    if out is None:
+        return np.empty(length, dtype=dtype)
+    assert out.shape == (length,)
+    # reject e.g. integer buffers, which the numba kernels would silently truncate into
+    assert np.can_cast(dtype, out.dtype, 'same_kind')
+    return out
 
-def overdrive(signal, threshold = 1/3):
+if _HAVE_NUMBA:
+    # per-sample effect kernels, compiled to native code on first call and cached on disk.
+    # they mirror the scalar algorithms and write into a preallocated out array, so they
+    # can also serve as building blocks for sample-by-sample (streaming) processing.
+    # every sample only depends on its own input sample and index, so the loops are
+    # split across all cores with prange.
+
+    @njit(parallel=True, cache=True, fastmath=True)
+    def _overdrive_kernel(signal, threshold, out):
+        for i in prange(len(signal)):
+            x = signal[i]
+            a = abs(x)
+            if a < threshold:
+                out[i] = 2 * x
+            elif a > 2 * threshold:
+                out[i] = np.sign(x)
+            else:
+                out[i] = np.sign(x) * (3 - (2 - a * 3) ** 2) / 3
+
+    @njit(parallel=True, cache=True, fastmath=True)
+    def _tremolo_kernel(signal, rate, depth, out):
+        for i in prange(len(signal)):
+            # LFO phase of this sample, no state carried between iterations
+            t = i * (rate * 0.002)
+            factor = 1 - (depth * 0.5 * np.sin(t) + 0.5)
+            out[i] = factor * signal[i]
+
+    @njit(parallel=True, cache=True, fastmath=True)
+    def _ring_mod_kernel(signal, modulator, rate, blend, out):
+        for i in prange(len(signal)):
+            # carrier phase of this sample, no state carried between iterations
+            t = i * (rate * 0.02)
+            if (modulator == 0):
+                factor = np.sin(t)
+            elif (modulator == 1):
+                factor = 1 - (2 / np.pi) * abs(((t + np.pi) % (2 * np.pi)) - np.pi)
+            else:
+                factor = 1.0 if np.sin(t) >= 0.0 else -1.0
+            out[i] = (1 - blend) * signal[i] + blend * factor * signal[i]
+
+def overdrive(signal, threshold = 1/3, out = None):
     '''
     Summary:
       Creates a soft-clipped version of the passed wave array.
@@ -212,32 +292,29 @@ def overdrive(signal, threshold = 1/3):
       signal:           - the wave array to process
       threshold:        - determines how steep the clipped wave form is. 
                           values exceeding 0.4 will no longer sound ok.
+      out:              - preallocated array to write the result to. must not be the
+                          passed signal itself. a new array is allocated if omitted (optional)
     Returns:
       the modified wave array
     '''
-    from numpy import zeros
-    N = len(signal)
-    y = zeros(N)
     signal = toMono(signal)
+    out = _output(out, len(signal), _float_dtype(signal))
+
+    if _HAVE_NUMBA:
+        _overdrive_kernel(signal, threshold, out)
+        return out
+
+    magnitude = np.abs(signal)
+    polarity = np.sign(signal)
+    # linear below the threshold, hard limit above twice the threshold,
+    # quadratic soft knee in between
+    out[...] = np.select(
+        [magnitude < threshold, magnitude > 2 * threshold],
+        [2 * signal, polarity],
+        polarity * (3 - (2 - magnitude * 3) ** 2) / 3)
+    return out
 
-    for i in range(1, N):
-        if abs(signal[i]) < threshold:
-            y[i] = 2 * signal[i]
-        if abs(signal[i]) > 2 * threshold:
-            if signal[i] > 0:
-                y[i] = 1
-            if signal[i] < 0:
-                y[i] = -1
-        elif abs(signal[i]) >= threshold:
-            if signal[i] > 0:
-                y[i] = (3 - (2 - signal[i] * 3) **2) / 3
-            if signal[i] < 0:
-                y[i] = - (3 - (2 - abs(signal[i]) * 3) ** 2) / 3
-        
-    return y
-
-def fuzz(signal, gain = 11, mix = 0.2):
-    from numpy import abs, exp, sign
+def fuzz(signal, gain = 11, mix = 0.2, out = None):
     '''
     Summary:
       Creates a distorted version of the passed wave array.
@@ -247,19 +324,25 @@ def fuzz(signal, gain = 11, mix = 0.2):
                       steeper wave forms.
       mix:          - the ratio of the wet signal to dry signal. a value of 1 will
                       return only the distorted part.
+      out:          - preallocated array to write the result to. must not be the
+                      passed signal itself. a new array is allocated if omitted (optional)
     Returns:
       the modified wave array
     '''
     
     signal = toMono(signal)
+    out = _output(out, len(signal), _float_dtype(signal))
+    peak = np.abs(signal).max()
     # downscale samples and multiply with gain value
-    q = signal * gain / max(abs(signal))    
+    q = signal * gain / peak
 	# invert sign and multiply with e-function
-    z = sign(-q) * (1 - exp(sign(-q)*q))
+    z = np.sign(-q) * (1 - np.exp(np.sign(-q)*q))
 	#  blend dry and upscaled wet signal
-    return mix * z * max(abs(signal))/max(abs(z))+(1-mix)*signal
+    np.multiply(z, mix * peak / np.abs(z).max(), out=out)
+    out += (1-mix)*signal
+    return out
 
-def tremolo(signal, rate = 0.5, depth = 0.5):
+def tremolo(signal, rate = 0.5, depth = 0.5, out = None):
     '''
     Algorithm translated to python from:
     https://wiki.analog.com/resources/tools-software/sharc-audio-module/baremetal/tremelo-effect-tutorial
@@ -270,28 +353,29 @@ def tremolo(signal, rate = 0.5, depth = 0.5):
       signal:       - the wave array to apply the effect to
       rate:         - rate of change. this factors into the modulating signal's frequency
       depth:        - modulation depth. 
+      out:          - preallocated array to write the result to. must not be the
+                      passed signal itself. a new array is allocated if omitted (optional)
     Returns:
       the modified wave array
     '''
 
-    from numpy import zeros, pi, sin
     assert (rate >= 0) and (rate <= 1) and (depth >= 0) and (depth <= 1) 
     
     signal = toMono(signal)
+    out = _output(out, len(signal), _float_dtype(signal))
 
-    t = 0.0
-    N = len(signal)
-    out = zeros(N)
-    for i in range(N):
-        # calculate modulation factor for this sample
-        factor = 1 - (depth * 0.5 * sin(t) + 0.5)
-        t += rate * 0.002
-        if (t > 2 * pi):
-            t -= 2 * pi
-        out[i] = factor * signal[i]
-    return out
+    if _HAVE_NUMBA:
+        _tremolo_kernel(signal, rate, depth, out)
+        return out
+
+    # LFO phase advances by rate * 0.002 per sample. sin is 2*pi-periodic,
+    # so the phase does not need to be wrapped.
+    t = np.arange(len(signal)) * (rate * 0.002)
+    # calculate modulation factor for every sample
+    factor = 1 - (depth * 0.5 * np.sin(t) + 0.5)
+    return np.multiply(factor, signal, out=out)
 
-def ring_modulator(signal, modulator, rate = 0.5, blend = 0.5):
+def ring_modulator(signal, modulator, rate = 0.5, blend = 0.5, out = None):
     '''
     Algorithm translated to python from:
     https://wiki.analog.com/resources/tools-software/sharc-audio-module/baremetal/ring-modulator-effect-tutorial
@@ -303,38 +387,36 @@ def ring_modulator(signal, modulator, rate = 0.5, blend = 0.5):
       modulator:    - the type of modulating wave form.
       rate:         - rate of change. this factors into the modulating signal's frequency.
       blend:        - the ratio of modulated signal to unmodulated signal. 
+      out:          - preallocated array to write the result to. must not be the
+                      passed signal itself. a new array is allocated if omitted (optional)
     Returns:
       the modified wave array
     '''
 
-    from numpy import zeros, pi, sin
     assert (rate >= 0) and (rate <= 1) and (blend >= 0) and (blend <= 1) and (modulator >= 0) and (modulator < 3)
-  
-    t = 0.0
-    N = len(signal)
-    out = zeros(N)    
 
     signal = toMono(signal)
+    out = _output(out, len(signal), _float_dtype(signal))
 
-    for i in range(N):       
-        
-        if (modulator == 0):
-            factor = sin(t)
-        elif (modulator == 1):
-            factor = triangle_alt(t)
-        elif (modulator == 2):
-            factor = square_wave(t)
-
-        t += rate * 0.02        
-
-        if (t > 2 * pi):
-            t -= 2 * pi
-        
-        out[i] = (1 - blend) * signal[i] + blend * factor * signal[i]
-    
-    return out
+    if _HAVE_NUMBA:
+        _ring_mod_kernel(signal, modulator, rate, blend, out)
+        return out
+
+    # carrier phase advances by rate * 0.02 per sample. all carrier wave forms
+    # are 2*pi-periodic, so the phase does not need to be wrapped.
+    t = np.arange(len(signal)) * (rate * 0.02)
 
-def FIR_delay(signal, delayMilliseconds, delayAmplitude, Fs = 48000):
+    if (modulator == 0):
+        factor = np.sin(t)
+    elif (modulator == 1):
+        factor = triangle_alt(t)
+    elif (modulator == 2):
+        factor = square_wave(t)
+
+    # (1 - blend) * signal + blend * factor * signal
+    return np.multiply((1 - blend) + blend * factor, signal, out=out)
+
+def FIR_delay(signal, delayMilliseconds, delayAmplitude, Fs = 48000, out = None):
     '''
     Summary:
       Applies a single echo to the signal by convoluting it with a simple
@@ -344,26 +426,33 @@ def FIR_delay(signal, delayMilliseconds, delayAmplitude, Fs = 48000):
       delayMilliseconds:    - the echo delay in milliseconds
       delayAmplitude:       - the echo amplitude
       Fs:                   - sampling frequency/sampling rate
+      out:                  - preallocated array to write the result to. must not be the
+                              passed signal itself. a new array is allocated if omitted (optional)
     Returns:
-      the modified wave array        
+      the modified wave array, delayInSamples - 1 samples longer than the signal
     '''
-    from numpy import zeros, convolve
     # Delay in seconds * sample rate = delay in samples
     delay = delayMilliseconds / 1000    
     delayInSamples = round(delay * Fs)
     
     signal = toMono(signal)
 
-    # Create simple delay impulse response. Sample value is relative amplitude.
-    # First sample is 1, last sample equals the delay amplitude, all samples in between are 0.
-    # This results in an echo with scaled amplitude on the out-signal after the set delay time
-    impulseResponse = zeros(delayInSamples)
-    impulseResponse[0] = 1
-    impulseResponse[-1] = delayAmplitude
-
-    # Returns the discrete, linear convolution of two one-dimensional sequences.
-    # https://numpy.org/doc/stable/reference/generated/numpy.convolve.html
-    return convolve(signal, impulseResponse)
+    # The impulse response of this effect is 1 at the first sample, the delay amplitude
+    # at the last sample and 0 everywhere in between. Convolving with it is the same as
+    # adding a scaled copy of the signal, shifted by the length of the impulse response
+    # minus one sample, to the signal itself. Doing that directly skips all the
+    # multiplications with 0 a full convolution would perform.
+    assert delayInSamples >= 1
+    N = len(signal)
+    shift = delayInSamples - 1
+    out = _output(out, N + shift, _float_dtype(signal))
+    if shift == 0:
+        # a single sample impulse response only holds the delay amplitude, the 1 is overwritten
+        return np.multiply(signal, delayAmplitude, out=out)
+    out[:N] = signal
+    out[N:] = 0
+    out[shift:] += delayAmplitude * signal
+    return out
 
 def Reverb(ir_samplingRate, impulseResponse, signal, Fs):
     '''
@@ -379,9 +468,6 @@ def Reverb(ir_samplingRate, impulseResponse, signal, Fs):
     Returns:
       the modified wave array          
     '''
-    from numpy import concatenate, zeros
-    from scipy.signal import fftconvolve
-
     impulseResponse = toMono(impulseResponse)
     assert impulseResponse.ndim == 1
 
@@ -391,21 +477,26 @@ def Reverb(ir_samplingRate, impulseResponse, signal, Fs):
     signal = toMono(signal)
     assert signal.ndim == 1
 
-    # apply convolution, using the tubby impulse response. scipy.signal allows applying convolution in the frequency domain
+    # convolve in the signal's precision. scipy uses single precision ffts
+    # if both arrays are float32
+    dtype = _float_dtype(signal)
+    signal = signal.astype(dtype, copy=False)
+    impulseResponse = impulseResponse.astype(dtype, copy=False)
+
+    # apply convolution, using the tubby impulse response. scipy.signal allows applying convolution in the frequency domain.
+    # overlap-add splits the signal into blocks sized to the impulse response, which keeps the ffts small for long signals
     # audio that has an effect applied to it is also called a "wet signal" (as opposed to a clean (dry) signal)
-    wetSignal = fftconvolve(signal, impulseResponse)
-    # normalize the signal (avoid distortion)
-    wetSignal = normalize(wetSignal)
+    wetSignal = oaconvolve(signal, impulseResponse)
 
-    # the wet signal is longer than the original signal. the original signal needs to be padded to be able to combine them
+    # the wet signal is longer than the original signal. the dry signal is added onto
+    # its first samples, the remaining tail of the wet signal has no dry part
     assert len(wetSignal) > len((signal))
-    # add some 0 to the end of the input signal to make up the difference
-    drySignal = concatenate((signal, zeros(len(wetSignal) - len(signal))))
-    assert len(wetSignal) == len(drySignal)
-    # normalize dry signal
-    drySignal = normalize(drySignal)
-
-    # combine dry signal with the wet signal. lower the magnitude of the wet signal by 6dB (approx. half the volume)
-    outSignal = drySignal + dB_to_magnitude(-3) * wetSignal
-    # normalize again to avoid clipping
-    return normalize(outSignal)
\ No newline at end of file
+
+    # scale both signals to the same peak level and combine them in the wet signal's buffer.
+    # lower the magnitude of the wet signal by 3dB
+    outSignal = wetSignal
+    outSignal *= dB_to_magnitude(-3) / np.abs(wetSignal).max()
+    outSignal[:len(signal)] += signal / np.abs(signal).max()
+    # normalize in place to avoid clipping, using the same amplitude as normalize()
+    outSignal *= 0.99 / np.abs(outSignal).max()
+    return outSignal
\ No newline at end of file